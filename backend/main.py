@@ -2,50 +2,98 @@ import os
 import sys
 from pathlib import Path
 
-import dotenv
+# only pay for python-dotenv when there is a file to read
+if os.path.exists(".env"):
+    import dotenv
+
+    dotenv.load_dotenv(".env", override=False)
 
-dotenv.load_dotenv()
 current_directory = Path(__file__).parent.parent
 
 sys.path.append(str(current_directory))
 
 import asyncio
+import concurrent.futures
+import hashlib
+import itertools
+import json
 import multiprocessing
+import operator
+import pickle
+import threading
+import time
 import traceback
-from copy import deepcopy
-from datetime import datetime
-from typing import Optional, Dict, List, Tuple
+from collections import OrderedDict
+from contextlib import nullcontext
+from copy import copy, deepcopy
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, ContextManager, Optional, Dict, List, Tuple
 from dataclasses import dataclass
+import orjson
 import uvicorn
 from uvicorn.config import LOGGING_CONFIG
 
 from fastapi import APIRouter, FastAPI, HTTPException
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse, JSONResponse
-from google.auth import default
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from fastapi.responses import (
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    Response,
+)
 from preql.constants import DEFAULT_NAMESPACE
 from preql.core.enums import DataType, Purpose
 from preql import Environment, Executor, Dialects
 from preql.parser import parse_text
 from pydantic import BaseModel, Field
+from sqlalchemy import column, create_engine, table
+from sqlalchemy.pool import StaticPool
 from starlette.background import BackgroundTask
 from trilogy_public_models import models as public_models
 from trilogy_public_models.inventory import parse_initial_models
 
-from sqlalchemy import create_engine
 from backend.io_models import ListModelResponse, Model, UIConcept
 from backend.models.helpers import flatten_lineage
-from duckdb_engine import *  # this is for pyinstaller
-from sqlalchemy_bigquery import *  # this is for pyinstaller
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
 
 PORT = 5678
 
+# seconds exit_app waits for cancelled tasks before stopping the loop
+SHUTDOWN_TIMEOUT = 5
+
 STATEMENT_LIMIT = 100
 
-app = FastAPI()
+QUERY_CACHE_SIZE = 512
+
+# rows per multi-row INSERT issued by /bulk_insert
+BULK_INSERT_BATCH_SIZES = {
+    Dialects.BIGQUERY: 1000,
+    Dialects.DUCK_DB: 10000,
+}
+
+# query endpoints hand their blocking database work to this pool
+# rather than sharing the event loop's default threadpool
+DB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=32, thread_name_prefix="db"
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+
+def pyinstaller_models_cache_path() -> Path:
+    # onefile bundles unpack to a new _MEIPASS on every launch, so the
+    # cache is keyed on the executable itself rather than that directory
+    from platformdirs import user_cache_dir
+
+    executable = Path(sys.executable)
+    stat = executable.stat()
+    build_hash = hashlib.sha256(
+        f"{executable}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8")
+    ).hexdigest()[:16]
+    return Path(user_cache_dir("trilogy-studio")) / f"preql_models_{build_hash}.pkl"
 
 
 def load_pyinstaller_trilogy_files() -> None:
@@ -54,6 +102,15 @@ def load_pyinstaller_trilogy_files() -> None:
     # so we manually load the modules here
     if not getattr(sys, "frozen", False):
         return
+    cache_path = pyinstaller_models_cache_path()
+    try:
+        with open(cache_path, "rb") as f:
+            public_models.update(pickle.load(f))
+        return
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ignoring unreadable model cache: {e}")
     # If the application is run as a bundle, the PyInstaller bootloader
     # extends the sys module by a flag frozen=True and sets the app
     # path into variable _MEIPASS'.
@@ -62,71 +119,257 @@ def load_pyinstaller_trilogy_files() -> None:
 
     test = Path(search_path)
 
+    loaded: Dict[str, Environment] = {}
     for item in test.glob("**/*preql"):
         if item.name == "entrypoint.preql":
             relative = item.parent.relative_to(test)
             model = parse_initial_models(str(item))
-            public_models[str(relative).replace("/", ".")] = model
+            loaded[str(relative).replace("/", ".")] = model
+    public_models.update(loaded)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        partial = cache_path.with_suffix(".tmp")
+        with open(partial, "wb") as f:
+            pickle.dump(loaded, f, protocol=pickle.HIGHEST_PROTOCOL)
+        partial.replace(cache_path)
+    except Exception as e:
+        print(f"Unable to write model cache: {e}")
 
 
 load_pyinstaller_trilogy_files()
 
 
+# one private full copy of each public model; connections get a
+# shallow snapshot of it rather than a full deepcopy of their own
+_ENV_TEMPLATES: Dict[str, Environment] = {}
+_ENV_TEMPLATES_LOCK = threading.Lock()
+
+
+def _clone_env(env: Environment) -> Environment:
+    # a pickle round trip runs in C and is several times faster than
+    # deepcopy's per-object dispatch, but not every model is picklable
+    try:
+        return pickle.loads(pickle.dumps(env, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return deepcopy(env)
+
+
+def _fresh_env(model_key: str) -> Environment:
+    """Return a copy of a public model that is safe to parse into.
+
+    Every mutable container on the environment (concepts, datasources,
+    imports, functions, options, ...) is duplicated; the objects inside
+    them are shared with the template and must be treated as immutable.
+    Parsing replaces entries rather than mutating them in place.
+    Raises KeyError if the model does not exist."""
+    template = _ENV_TEMPLATES.get(model_key)
+    if template is None:
+        with _ENV_TEMPLATES_LOCK:
+            template = _ENV_TEMPLATES.get(model_key)
+            if template is None:
+                template = _clone_env(public_models[model_key])
+                _ENV_TEMPLATES[model_key] = template
+    env = copy(template)
+    for name, value in vars(template).items():
+        if isinstance(value, (dict, list, set, BaseModel)):
+            setattr(env, name, copy(value))
+    # the concept dict records lookups of unknown names on itself
+    undefined = getattr(env.concepts, "undefined", None)
+    if isinstance(undefined, dict):
+        env.concepts.undefined = dict(undefined)
+    return env
+
+
 @dataclass
 class InstanceSettings:
     connections: Dict[str, Executor]
     models: Dict[str, Environment]
 
 
+# the electron shell loads from file:// when packaged, which browsers
+# report as Origin: null, and from the vite dev server otherwise (playwright
+# serves it on 127.0.0.1); sets keep origin checks to a hash lookup
+ALLOWED_ORIGINS = frozenset(
+    [
+        "app://.",
+        "null",
+        "http://localhost:5173",
+        "http://localhost:8080",
+        "http://localhost:8081",
+        "http://localhost:8090",
+        "http://127.0.0.1:5173",
+        "http://127.0.0.1:8080",
+        "http://127.0.0.1:8081",
+        "http://127.0.0.1:8090",
+    ]
+)
+ALLOWED_METHODS = frozenset(["GET", "POST", "PUT", "OPTIONS"])
+ALLOWED_HEADERS = frozenset(["content-type"])
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    # allow_origins=[
-    #     "http://localhost:8080",
-    #     "http://localhost:8081",
-    #     "http://localhost:8090",
-    #     "app://.",
-    # ],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=ALLOWED_METHODS,
+    allow_headers=ALLOWED_HEADERS,
+    # chromium caps this at two hours; fewer repeat preflights
+    max_age=7200,
 )
 
 
-def generate_default_duckdb():
-    duckdb = Environment()
-    executor = Executor(
-        dialect=Dialects.DUCK_DB,
-        engine=create_engine("duckdb:///:memory:"),
-        environment=duckdb,
+# engines are reused across reconnects so credential discovery, client
+# setup and in-memory databases are not rebuilt on every connection refresh
+_BQ_ENGINES: Dict[Tuple[str, str], "Engine"] = {}
+_DUCKDB_ENGINES: Dict[str, "Engine"] = {}
+_ENGINES_LOCK = threading.Lock()
+# engines whose single shared connection cannot run statements concurrently
+_ENGINE_STATEMENT_LOCKS: Dict["Engine", threading.Lock] = {}
+_NO_LOCK = nullcontext()
+
+
+def get_bigquery_engine(extra: Dict | None) -> "Engine":
+    extra = extra or {}
+    if extra.get("user_or_service_auth_json"):
+        source = extra["user_or_service_auth_json"]
+    elif os.path.isfile("/run/secrets/bigquery_auth"):
+        source = "/run/secrets/bigquery_auth"
+    elif "GOOGLE_APPLICATION_CREDENTIALS" in os.environ:
+        source = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
+    else:
+        source = "default"
+    cache_key = (
+        extra.get("project") or "",
+        hashlib.sha256(source.encode("utf-8")).hexdigest(),
     )
-    return executor
+    with _ENGINES_LOCK:
+        if cache_key in _BQ_ENGINES:
+            return _BQ_ENGINES[cache_key]
+        engine = _create_bigquery_engine(extra)
+        _BQ_ENGINES[cache_key] = engine
+        return engine
 
 
-def generate_default_bigquery() -> Executor:
-    if os.path.isfile("/run/secrets/bigquery_auth"):
+def _create_bigquery_engine(extra: Dict) -> "Engine":
+    from google.auth import default
+    from google.cloud import bigquery
+    from google.oauth2 import service_account
+
+    if extra.get("user_or_service_auth_json"):
+        from google.auth._default import load_credentials_from_dict
+
+        credentials, project = load_credentials_from_dict(
+            json.loads(extra["user_or_service_auth_json"])
+        )
+    elif os.path.isfile("/run/secrets/bigquery_auth"):
         credentials = service_account.Credentials.from_service_account_file(
             "/run/secrets/bigquery_auth",
             scopes=["https://www.googleapis.com/auth/cloud-platform"],
         )
         project = credentials.project_id
+    elif "GOOGLE_APPLICATION_CREDENTIALS" in os.environ:
+        credentials = service_account.Credentials.from_service_account_file(
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"],
+            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        )
+        project = credentials.project_id
     else:
         credentials, project = default()
+    project = extra.get("project", project)
+    if not project:
+        raise HTTPException(
+            status_code=400,
+            detail="BigQuery dialect requires a project to be specified in the extra field",
+        )
     client = bigquery.Client(credentials=credentials, project=project)
-    engine = create_engine(
+    # no pool_pre_ping; each ping would be a billed BigQuery job
+    return create_engine(
         f"bigquery://{project}/test_tables?user_supplied_client=True",
         connect_args={"client": client},
+        pool_size=10,
+        max_overflow=5,
+    )
+
+
+def get_duckdb_engine(name: str) -> "Engine":
+    with _ENGINES_LOCK:
+        if name not in _DUCKDB_ENGINES:
+            # a single shared connection, so every request sees the same
+            # in-memory database rather than one per pooled connection
+            engine = create_engine("duckdb:///:memory:", poolclass=StaticPool)
+            _DUCKDB_ENGINES[name] = engine
+            _ENGINE_STATEMENT_LOCKS[engine] = threading.Lock()
+        return _DUCKDB_ENGINES[name]
+
+
+def engine_lock(engine: "Engine") -> ContextManager:
+    # hold across execute and fetch; duckdb engines share one connection
+    # between all DB_EXECUTOR threads, so interleaved statements would
+    # close each other's result sets
+    return _ENGINE_STATEMENT_LOCKS.get(engine, _NO_LOCK)
+
+
+def generate_default_duckdb():
+    duckdb = Environment()
+    executor = Executor(
+        dialect=Dialects.DUCK_DB,
+        engine=create_engine("duckdb:///:memory:"),
+        environment=duckdb,
     )
+    return executor
+
+
+def generate_default_bigquery() -> Executor:
+    engine = get_bigquery_engine(None)
     executor = Executor(
         dialect=Dialects.BIGQUERY,
         engine=engine,
-        environment=deepcopy(public_models["bigquery.stack_overflow"]),
+        environment=_fresh_env("bigquery.stack_overflow"),
     )
     return executor
 
 
 CONNECTIONS: Dict[str, Executor] = {}
 
+# bumped whenever a connection is (re)created, so cached query plans
+# never outlive the environment they were generated against
+_CONNECTION_REVISIONS: Dict[str, int] = {}
+_REVISION_COUNTER = itertools.count()
+
+# (connection revision, query text) -> [(compiled sql, statement)]
+_QUERY_PLANS: "OrderedDict[Tuple[int, str], List[Tuple[str, Any]]]" = OrderedDict()
+_QUERY_PLANS_LOCK = threading.Lock()
+
+
+def get_query_plan(key: Tuple[int, str]) -> List[Tuple[str, Any]] | None:
+    with _QUERY_PLANS_LOCK:
+        plan = _QUERY_PLANS.get(key)
+        if plan is not None:
+            _QUERY_PLANS.move_to_end(key)
+        return plan
+
+
+def store_query_plan(key: Tuple[int, str], plan: List[Tuple[str, Any]]) -> None:
+    with _QUERY_PLANS_LOCK:
+        _QUERY_PLANS[key] = plan
+        _QUERY_PLANS.move_to_end(key)
+        if len(_QUERY_PLANS) > QUERY_CACHE_SIZE:
+            _QUERY_PLANS.popitem(last=False)
+
+
+def environment_state(env: Environment) -> Tuple[Dict[str, int], ...]:
+    # identities rather than values; a redefinition replaces the object
+    return tuple(
+        {key: id(value) for key, value in container.items()}
+        for container in (
+            env.concepts,
+            env.datasources,
+            env.imports,
+            env.functions,
+            env.data_types,
+        )
+    )
+
+
 ## BEGIN REQUESTS
 
 
@@ -186,17 +429,65 @@ class QueryOut(BaseModel):
     generated_sql: str
     headers: list[str]
     results: list[dict]
-    created_at: datetime = Field(default_factory=datetime.now)
-    refreshed_at: datetime = Field(default_factory=datetime.now)
+    created_at: datetime
+    refreshed_at: datetime
     duration: Optional[int]
     columns: List[Tuple[str, QueryOutColumn]] | None
 
 
+class BulkInsertInSchema(BaseModel):
+    connection: str
+    table: str
+    columns: List[str]
+    rows: List[List[Any]]
+
+
+class BulkInsertOut(BaseModel):
+    connection: str
+    table: str
+    inserted: int
+    duration: Optional[int]
+
+
+class QueryResponse(ORJSONResponse):
+    # result rows can hold values orjson has no native encoding for,
+    # such as Decimal from BigQuery NUMERIC; those go via jsonable_encoder
+    def render(self, content: Any) -> bytes:
+        try:
+            return orjson.dumps(
+                content,
+                default=jsonable_encoder,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+            )
+        except TypeError:
+            # orjson rejects ints beyond 64 bits (duckdb HUGEINT, BigQuery
+            # BIGNUMERIC) without consulting default; the stdlib does not
+            return JSONResponse.render(self, jsonable_encoder(content))
+
+
 def safe_format_query(input: str) -> str:
     input = input.strip()
-    if input[-1] != ";":
-        return input + ";"
-    return input
+    if not input:
+        return ";"
+    return input if input.endswith(";") else input + ";"
+
+
+def fetch_results(rs, keys: List[str], limit: int | None = None) -> List[dict]:
+    # a limited query is read with one fetchmany; otherwise drain in batches
+    columns = ["_index", *keys]
+    output: List[dict] = []
+    while True:
+        rows = rs.fetchmany(limit or STATEMENT_LIMIT)
+        if not rows:
+            break
+        offset = len(output)
+        output += [
+            dict(zip(columns, (idx, *row)))
+            for idx, row in zip(range(offset, offset + len(rows)), rows)
+        ]
+        if limit:
+            break
+    return output
 
 
 def parse_env_from_full_model(input: ModelInSchema) -> Environment:
@@ -209,11 +500,15 @@ def parse_env_from_full_model(input: ModelInSchema) -> Environment:
     return env
 
 
-@router.get("/models", response_model=ListModelResponse)
-async def get_models() -> ListModelResponse:
+# public models are fixed once loaded, so the /models payload
+# is built on first request and served from memory afterwards
+_MODELS_CACHE: bytes | None = None
+_MODELS_CACHE_LOCK = threading.Lock()
+
+
+def build_models_response() -> ListModelResponse:
     models = []
     for key, value in public_models.items():
-        value = public_models[key]
         final_concepts = []
         for skey, sconcept in value.concepts.items():
             # don't show private concepts
@@ -234,11 +529,29 @@ async def get_models() -> ListModelResponse:
                     lineage=flatten_lineage(sconcept, depth=0),
                 )
             )
-        final_concepts.sort(key=lambda x: x.namespace + x.key)
+        final_concepts.sort(key=operator.attrgetter("namespace", "key"))
         models.append(Model(name=key, concepts=final_concepts))
     return ListModelResponse(models=models)
 
 
+def get_models_payload() -> bytes:
+    global _MODELS_CACHE
+    payload = _MODELS_CACHE
+    if payload is not None:
+        return payload
+    with _MODELS_CACHE_LOCK:
+        payload = _MODELS_CACHE
+        if payload is None:
+            payload = orjson.dumps(jsonable_encoder(build_models_response()))
+            _MODELS_CACHE = payload
+    return payload
+
+
+@router.get("/models", response_model=ListModelResponse)
+async def get_models() -> Response:
+    return Response(content=get_models_payload(), media_type="application/json")
+
+
 @router.get("/connections")
 async def list_connections():
     output = []
@@ -265,107 +578,94 @@ def create_connection(connection: ConnectionInSchema):
             raise HTTPException(status_code=500, detail=str(e))
     elif connection.model:
         try:
-            environment = deepcopy(public_models[connection.model])
+            environment = _fresh_env(connection.model)
         except KeyError:
             environment = Environment()
     else:
         environment = Environment()
     if connection.dialect == Dialects.BIGQUERY:
-        if connection.extra and connection.extra.get("user_or_service_auth_json"):
-            import json
-            from google.auth._default import load_credentials_from_dict
-
-            credentials, project = load_credentials_from_dict(
-                json.loads(connection.extra["user_or_service_auth_json"])
-            )
-        elif os.path.isfile("/run/secrets/bigquery_auth"):
-            credentials = service_account.Credentials.from_service_account_file(
-                "/run/secrets/bigquery_auth",
-                scopes=["https://www.googleapis.com/auth/cloud-platform"],
-            )
-            project = credentials.project_id
-        elif "GOOGLE_APPLICATION_CREDENTIALS" in os.environ:
-            credentials = service_account.Credentials.from_service_account_file(
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"],
-                scopes=["https://www.googleapis.com/auth/cloud-platform"],
-            )
-            project = credentials.project_id
-        else:
-            credentials, project = default()
-        if connection.extra:
-            project = connection.extra.get("project", project)
-        if not project:
-            raise HTTPException(
-                status_code=400,
-                detail="BigQuery dialect requires a project to be specified in the extra field",
-            )
-        client = bigquery.Client(credentials=credentials, project=project)
-        engine = create_engine(
-            f"bigquery://{project}/test_tables?user_supplied_client=True",
-            connect_args={"client": client},
-        )
+        engine = get_bigquery_engine(connection.extra)
         executor = Executor(
             dialect=connection.dialect, engine=engine, environment=environment
         )
     elif connection.dialect == Dialects.DUCK_DB:
         executor = Executor(
             dialect=connection.dialect,
-            engine=create_engine("duckdb:///:memory:"),
+            engine=get_duckdb_engine(connection.name),
             environment=environment,
         )
     else:
         raise HTTPException(400, "this dialect type is not supported currently")
+    # executor before revision; execute_query reads them in reverse
     CONNECTIONS[connection.name] = executor
+    _CONNECTION_REVISIONS[connection.name] = next(_REVISION_COUNTER)
 
 
-@router.post("/raw_query")
-def run_raw_query(query: QueryInSchema):
-    start = datetime.now()
+@router.post("/raw_query", response_class=QueryResponse)
+async def run_raw_query(query: QueryInSchema):
+    loop = asyncio.get_running_loop()
+    output = await loop.run_in_executor(DB_EXECUTOR, execute_raw_query, query)
+    return QueryResponse(content=output.dict())
+
+
+def execute_raw_query(query: QueryInSchema) -> QueryOut:
+    start = time.perf_counter_ns()
     # we need to use a deepcopy here to avoid mutation the model default
     executor = CONNECTIONS.get(query.connection)
     if not executor:
         raise HTTPException(401, "Not a valid connection")
     try:
-        rs = executor.engine.execute(query.query)
-        outputs = [
-            (
-                col,
-                QueryOutColumn(
-                    name=col,
-                    purpose=Purpose.KEY,
-                    datatype=DataType.STRING,
-                ),
-            )
-            for col in rs.keys()
-        ]
+        with engine_lock(executor.engine):
+            rs = executor.engine.execute(query.query)
+            # read the cursor description once for both headers and columns
+            headers = list(rs.keys())
+            if not rs:
+                headers = []
+                query_output = []
+            else:
+                query_output = fetch_results(rs, headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    if not rs:
-        headers = []
-        query_output = []
-    else:
-        headers = list(rs.keys())
-        query_output = [
-            {"_index": idx, **dict(row.items())}
-            for idx, row in enumerate(rs.fetchall())
-        ]
+    outputs = [
+        (
+            col,
+            QueryOutColumn(
+                name=col,
+                purpose=Purpose.KEY,
+                datatype=DataType.STRING,
+            ),
+        )
+        for col in headers
+    ]
     # return execution time to frontend
-    delta = datetime.now() - start
+    duration = (time.perf_counter_ns() - start) // 1_000_000
+    now = datetime.now(timezone.utc)
     output = QueryOut(
         connection=query.connection,
         query=query.query,
         generated_sql=query.query,
         headers=headers,
         results=query_output,
-        duration=int(delta.total_seconds() * 1000),
+        created_at=now,
+        refreshed_at=now,
+        duration=duration,
         columns=outputs,
     )
     return output
 
 
-@router.post("/query")
-def run_query(query: QueryInSchema):
-    start = datetime.now()
+@router.post("/query", response_class=QueryResponse)
+async def run_query(query: QueryInSchema):
+    loop = asyncio.get_running_loop()
+    output = await loop.run_in_executor(DB_EXECUTOR, execute_query, query)
+    return QueryResponse(content=output.dict())
+
+
+def execute_query(query: QueryInSchema) -> QueryOut:
+    start = time.perf_counter_ns()
+    # read before the executor; create_connection publishes the executor
+    # first, so a current revision never pairs with a replaced executor
+    revision = _CONNECTION_REVISIONS.get(query.connection)
     # we need to use a deepcopy here to avoid mutation the model default
     executor = CONNECTIONS.get(query.connection)
     if not executor:
@@ -374,66 +674,131 @@ def run_query(query: QueryInSchema):
         )
 
     outputs = []
-    # parsing errors or generation
-    # should be 422
-    try:
-        _, parsed = parse_text(safe_format_query(query.query), executor.environment)
-        sql = executor.generator.generate_queries(executor.environment, parsed)
-    except Exception as e:
-        print(e)
-        raise HTTPException(status_code=422, detail="Parsing error: " + str(e))
+    # re-running the same text against the same connection
+    # skips parsing, generation and compilation entirely
+    plan = None
+    if revision is not None:
+        plan = get_query_plan((revision, query.query))
+    if plan is None:
+        before = environment_state(executor.environment)
+        # parsing errors or generation
+        # should be 422
+        try:
+            _, parsed = parse_text(safe_format_query(query.query), executor.environment)
+            sql = executor.generator.generate_queries(executor.environment, parsed)
+        except Exception as e:
+            print(e)
+            raise HTTPException(status_code=422, detail="Parsing error: " + str(e))
+        finally:
+            declared = environment_state(executor.environment) != before
+            if declared:
+                # the parse declared or redefined something, so plans
+                # compiled against the old environment are stale
+                _CONNECTION_REVISIONS[query.connection] = next(_REVISION_COUNTER)
+        try:
+            plan = []
+            for statement in sql:
+                # for UI execution, cap the limit
+                statement.limit = (
+                    min(int(statement.limit), STATEMENT_LIMIT)
+                    if statement.limit
+                    else STATEMENT_LIMIT
+                )
+                plan.append(
+                    (executor.generator.compile_statement(statement), statement)
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        # a declaring query must re-run its declarations, so only
+        # plans whose parse left the environment untouched are cached
+        if not declared and revision is not None:
+            store_query_plan((revision, query.query), plan)
     # execution errors should be 500
     try:
-        rs = None
-        compiled_sql = ""
-        for statement in sql:
-            # for UI execution, cap the limit
-            statement.limit = (
-                min(int(statement.limit), STATEMENT_LIMIT)
-                if statement.limit
-                else STATEMENT_LIMIT
-            )
-            compiled_sql = executor.generator.compile_statement(statement)
-            rs = executor.engine.execute(compiled_sql)
-            outputs = [
-                (
-                    col.name,
-                    QueryOutColumn(
-                        name=col.name.replace(".", "_")
-                        if col.namespace == DEFAULT_NAMESPACE
-                        else col.address.replace(".", "_"),
-                        purpose=col.purpose,
-                        datatype=col.datatype,
-                    ),
-                )
-                for col in statement.output_columns
-            ]
-
+        with engine_lock(executor.engine):
+            rs = None
+            compiled_sql = ""
+            for compiled_sql, statement in plan:
+                rs = executor.engine.execute(compiled_sql)
+            if not rs:
+                headers = []
+                query_output = []
+            else:
+                headers = list(rs.keys())
+                query_output = fetch_results(rs, headers, limit=STATEMENT_LIMIT)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    if not rs:
-        headers = []
-        query_output = []
-    else:
-        headers = list(rs.keys())
-        query_output = [
-            {"_index": idx, **dict(row.items())}
-            for idx, row in enumerate(rs.fetchall())
+    # only the final statement's columns are returned to the UI
+    if plan:
+        _, statement = plan[-1]
+        outputs = [
+            (
+                col.name,
+                QueryOutColumn(
+                    name=col.name.replace(".", "_")
+                    if col.namespace == DEFAULT_NAMESPACE
+                    else col.address.replace(".", "_"),
+                    purpose=col.purpose,
+                    datatype=col.datatype,
+                ),
+            )
+            for col in statement.output_columns
         ]
     # return execution time to frontend
-    delta = datetime.now() - start
+    duration = (time.perf_counter_ns() - start) // 1_000_000
+    now = datetime.now(timezone.utc)
     output = QueryOut(
         connection=query.connection,
         query=query.query,
         generated_sql=compiled_sql,
         headers=headers,
         results=query_output,
-        duration=int(delta.total_seconds() * 1000),
+        created_at=now,
+        refreshed_at=now,
+        duration=duration,
         columns=outputs,
     )
     return output
 
 
+@router.post("/bulk_insert")
+async def bulk_insert(insert: BulkInsertInSchema):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, execute_bulk_insert, insert)
+
+
+def execute_bulk_insert(insert: BulkInsertInSchema) -> BulkInsertOut:
+    start = time.perf_counter_ns()
+    executor = CONNECTIONS.get(insert.connection)
+    if not executor:
+        raise HTTPException(401, "Not a valid connection")
+    width = len(insert.columns)
+    if not width or any(len(row) != width for row in insert.rows):
+        raise HTTPException(422, f"Every row must have {width} values")
+    schema, _, name = insert.table.rpartition(".")
+    target = table(
+        name, *[column(col) for col in insert.columns], schema=schema or None
+    )
+    batch_size = BULK_INSERT_BATCH_SIZES.get(executor.dialect, 1000)
+    try:
+        with engine_lock(executor.engine), executor.engine.begin() as conn:
+            for offset in range(0, len(insert.rows), batch_size):
+                batch = insert.rows[offset : offset + batch_size]
+                conn.execute(
+                    target.insert().values(
+                        [dict(zip(insert.columns, row)) for row in batch]
+                    )
+                )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return BulkInsertOut(
+        connection=insert.connection,
+        table=insert.table,
+        inserted=len(insert.rows),
+        duration=(time.perf_counter_ns() - start) // 1_000_000,
+    )
+
+
 ## Core
 @router.get("/")
 async def healthcheck():
@@ -448,6 +813,7 @@ async def terminate():
 @app.on_event("shutdown")
 def shutdown_event():
     print("Shutting down...!")
+    DB_EXECUTOR.shutdown(wait=False, cancel_futures=True)
 
 
 def _get_last_exc():
@@ -457,14 +823,20 @@ def _get_last_exc():
 
 
 async def exit_app():
-    for task in asyncio.all_tasks():
+    # this runs inside a request task, so leave that one alone
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
         print(f"cancelling task: {task}")
         try:
             task.cancel()
         except Exception:
             print(f"Task kill failed: {_get_last_exc()}")
             pass
-    asyncio.gather(*asyncio.all_tasks())
+    # let cancellations unwind before stopping the loop; the timeout
+    # guards against a task that is itself waiting on this request
+    if tasks:
+        await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
     loop = asyncio.get_running_loop()
     loop.stop()
 
@@ -478,10 +850,11 @@ async def http_exception_handler(request, exc: HTTPException):
         return PlainTextResponse(
             "Server is shutting down", status_code=exc.status_code, background=task
         )
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=jsonable_encoder({"detail": exc.detail}),
-    )
+    detail = exc.detail
+    # every detail raised in this module is a plain string
+    if not isinstance(detail, (str, int, float, bool, type(None))):
+        detail = jsonable_encoder(detail)
+    return ORJSONResponse(status_code=exc.status_code, content={"detail": detail})
 
 
 app.include_router(router)
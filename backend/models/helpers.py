@@ -1,4 +1,5 @@
-from typing import Any, List, Union
+from collections import deque
+from typing import Any, Deque, List, Tuple, Union
 
 from preql.core.enums import DataType
 from preql.core.models import (
@@ -14,32 +15,24 @@ from preql.core.models import (
 from backend.io_models import LineageItem
 
 
-def flatten_array(input: Any, depth: int = 0) -> List[LineageItem]:
+# pending work is either a finished token or a (value, depth) pair
+# still to be expanded; keeping an explicit stack rather than recursing
+# avoids a python frame per lineage node on large models
+_Pending = Union[LineageItem, Tuple[Any, int]]
+
+
+def _array_items(input: Any, depth: int) -> List[_Pending]:
     arr_len = len(input)
-    output = []
+    output: List[_Pending] = []
     for idx, val in enumerate(input):
-        output += flatten_lineage(val, depth)
+        output.append((val, depth))
         if idx < arr_len - 1:
             output.append(LineageItem(token=",", depth=depth - 1))
     return output
 
 
-def flatten_lineage(
-    input: Union[
-        Concept,
-        int,
-        float,
-        str,
-        DataType,
-        Function,
-        WindowItem,
-        FilterItem,
-        Conditional,
-        Comparison,
-        AggregateWrapper,
-    ],
-    depth: int = 0,
-) -> List[LineageItem]:
+def _expand(input: Any, depth: int) -> List[_Pending]:
+    chain: List[_Pending]
     if depth == 0:
         chain = []
     elif isinstance(input, Function):
@@ -47,30 +40,30 @@ def flatten_lineage(
             LineageItem(token=input.operator.name, depth=depth),
             LineageItem(token="(", depth=depth),
         ]  # ], ')']
-        chain += flatten_array(input.arguments, depth + 1)
+        chain += _array_items(input.arguments, depth + 1)
         chain += [LineageItem(token=")", depth=depth)]
     elif isinstance(input, WindowItem):
         chain = [
             LineageItem(token="rank", depth=depth),
             LineageItem(token="(", depth=depth),
         ]  # ], ')']
-        chain += flatten_lineage(input.content, depth + 1)
+        chain += [(input.content, depth + 1)]
         chain += [LineageItem(token="over", depth=depth)]
-        chain += flatten_array(input.over, depth + 1)
+        chain += _array_items(input.over, depth + 1)
         chain += [LineageItem(token="order by", depth=depth)]
-        chain += flatten_array(input.order_by, depth + 1)
+        chain += _array_items(input.order_by, depth + 1)
         chain += [LineageItem(token=")", depth=depth)]
     elif isinstance(input, FilterItem):
         chain = [
             LineageItem(token="filter", depth=depth),
             LineageItem(token="(", depth=depth),
         ]  # ], ')']
-        chain += flatten_lineage(input.content, depth + 1)
+        chain += [(input.content, depth + 1)]
         chain += [LineageItem(token="by", depth=depth)]
-        chain += flatten_array(input.where.input, depth + 1)
+        chain += _array_items(input.where.input, depth + 1)
         chain += [LineageItem(token=")", depth=depth)]
     elif isinstance(input, AggregateWrapper):
-        return flatten_lineage(input.function, depth)
+        return [(input.function, depth)]
     elif not isinstance(input, Concept):
         return [LineageItem(token=str(input), depth=depth)]
     else:
@@ -78,5 +71,41 @@ def flatten_lineage(
     if isinstance(input, Concept) and input.lineage:
         if not depth == 0:
             chain += [LineageItem(token="<-", depth=depth)]
-        chain += flatten_lineage(input.lineage, depth + 1)
+        chain += [(input.lineage, depth + 1)]
     return chain
+
+
+def _walk(pending: List[_Pending]) -> List[LineageItem]:
+    output: List[LineageItem] = []
+    stack: Deque[_Pending] = deque(reversed(pending))
+    while stack:
+        item = stack.pop()
+        if isinstance(item, LineageItem):
+            output.append(item)
+            continue
+        value, depth = item
+        stack.extend(reversed(_expand(value, depth)))
+    return output
+
+
+def flatten_array(input: Any, depth: int = 0) -> List[LineageItem]:
+    return _walk(_array_items(input, depth))
+
+
+def flatten_lineage(
+    input: Union[
+        Concept,
+        int,
+        float,
+        str,
+        DataType,
+        Function,
+        WindowItem,
+        FilterItem,
+        Conditional,
+        Comparison,
+        AggregateWrapper,
+    ],
+    depth: int = 0,
+) -> List[LineageItem]:
+    return _walk([(input, depth)])
@@ -1,5 +1,18 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
 from fastapi.testclient import TestClient
-from ..main import ConnectionInSchema
+from ..main import (
+    _QUERY_PLANS,
+    BULK_INSERT_BATCH_SIZES,
+    ConnectionInSchema,
+    QueryResponse,
+    _fresh_env,
+    safe_format_query,
+)
+from preql import Dialects
 from typing import List, Mapping
 from trilogy_public_models import models as public_models
 
@@ -9,6 +22,12 @@ def test_read_main(test_client: TestClient):
     assert response.status_code == 200
 
 
+def test_safe_format_query():
+    assert safe_format_query(" select x ") == "select x;"
+    assert safe_format_query("select x;\n") == "select x;"
+    assert safe_format_query("   ") == ";"
+
+
 def test_read_models(test_client: TestClient):
     response = test_client.get("/models")
     assert response.status_code == 200
@@ -36,6 +55,199 @@ def test_read_models(test_client: TestClient):
         assert response.status_code == 200
 
 
+def test_read_models_cached(test_client: TestClient):
+    first = test_client.get("/models")
+    second = test_client.get("/models")
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/json"
+    assert first.content == second.content
+    assert {model["name"] for model in first.json()["models"]} == set(
+        public_models.keys()
+    )
+
+
+def test_invalid_connection_detail(test_client: TestClient):
+    response = test_client.post(
+        "/raw_query", json={"connection": "missing", "query": "select 1"}
+    )
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Not a valid connection"}
+
+
+def test_bulk_insert_validation(test_client: TestClient):
+    response = test_client.post(
+        "/bulk_insert",
+        json={"connection": "missing", "table": "t", "columns": ["a"], "rows": []},
+    )
+    assert response.status_code == 401
+
+    parsed = ConnectionInSchema.parse_obj(
+        {"name": "test-bulk", "dialect": "duck_db", "model": None, "extra": None}
+    )
+    response = test_client.post("/connection", data=parsed.json())  # type: ignore
+    assert response.status_code == 200
+    response = test_client.post(
+        "/bulk_insert",
+        json={
+            "connection": "test-bulk",
+            "table": "t",
+            "columns": ["a", "b"],
+            "rows": [[1, "x"], [2]],
+        },
+    )
+    assert response.status_code == 422
+
+
+def test_fresh_env_snapshots_are_isolated():
+    model = list(public_models.keys())[0]
+    first = _fresh_env(model)
+    second = _fresh_env(model)
+    for name, value in vars(first).items():
+        if isinstance(value, (dict, list, set)):
+            assert value is not getattr(second, name), name
+
+    if hasattr(first.concepts, "undefined"):
+        assert first.concepts.undefined is not second.concepts.undefined
+
+    before = set(second.concepts)
+    first.parse("key snapshot_isolation_check int;")
+    added = set(first.concepts) - before
+
+    assert added
+    assert set(second.concepts) == before
+    assert not added & set(_fresh_env(model).concepts)
+
+
+def test_concurrent_duckdb_queries(test_client: TestClient):
+    parsed = ConnectionInSchema.parse_obj(
+        {"name": "test-concurrent", "dialect": "duck_db", "model": None, "extra": None}
+    )
+    response = test_client.post("/connection", data=parsed.json())  # type: ignore
+    assert response.status_code == 200
+
+    def run(idx: int):
+        return test_client.post(
+            "/raw_query",
+            json={"connection": "test-concurrent", "query": f"select {idx} as x"},
+        )
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(run, range(64)))
+    assert [r.status_code for r in responses] == [200] * 64
+    assert [r.json()["results"][0]["x"] for r in responses] == list(range(64))
+
+
+def test_query_plan_cache_invalidation(test_client: TestClient):
+    def connect():
+        parsed = ConnectionInSchema.parse_obj(
+            {"name": "test-plans", "dialect": "duck_db", "model": None, "extra": None}
+        )
+        response = test_client.post("/connection", data=parsed.json())  # type: ignore
+        assert response.status_code == 200
+
+    def run(text: str):
+        return test_client.post(
+            "/query", json={"connection": "test-plans", "query": text}
+        )
+
+    def values(text: str):
+        response = run(text)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return [[row[key] for key in body["headers"]] for row in body["results"]]
+
+    def datasource(value: int):
+        return f"datasource t (x:x) grain (x) query '''select {value} as x''';"
+
+    connect()
+    assert values("key x int; " + datasource(1) + " select x;") == [[1]]
+    cached = len(_QUERY_PLANS)
+    assert values("select x;") == [[1]]
+    assert values("select x;") == [[1]]
+    assert len(_QUERY_PLANS) == cached + 1
+
+    # redefining the datasource must not serve the earlier plan
+    values(datasource(2))
+    assert values("select x;") == [[2]]
+
+    # a cached declaring query would skip its own redefinition
+    assert values("const y <- 5; select y;") == [[5]]
+    values("const y <- 6;")
+    assert values("const y <- 5; select y;") == [[5]]
+
+    # a reconnect starts from a fresh environment
+    connect()
+    assert run("select x;").status_code == 422
+
+
+def test_query_response_wide_values(test_client: TestClient):
+    body = QueryResponse(content={"d": Decimal("1.5"), "h": 2**64}).body
+    assert json.loads(body) == {"d": 1.5, "h": 2**64}
+
+    parsed = ConnectionInSchema.parse_obj(
+        {"name": "test-wide", "dialect": "duck_db", "model": None, "extra": None}
+    )
+    response = test_client.post("/connection", data=parsed.json())  # type: ignore
+    assert response.status_code == 200
+    query = "select 18446744073709551616::hugeint as h, 1.5::decimal(4, 2) as d"
+    response = test_client.post(
+        "/raw_query", json={"connection": "test-wide", "query": query}
+    )
+    assert response.status_code == 200
+    assert response.json()["results"][0]["h"] == 2**64
+    assert response.json()["results"][0]["d"] == 1.5
+
+
+def test_cors_origins(test_client: TestClient):
+    def preflight(origin: str):
+        return test_client.options(
+            "/query",
+            headers={"Origin": origin, "Access-Control-Request-Method": "POST"},
+        )
+
+    for origin in ("http://127.0.0.1:5173", "http://localhost:5173", "null"):
+        response = preflight(origin)
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] == origin
+    assert preflight("file://").status_code == 400
+
+
+def test_bulk_insert_round_trip(
+    test_client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    # small batches so five rows span three INSERT statements
+    monkeypatch.setitem(BULK_INSERT_BATCH_SIZES, Dialects.DUCK_DB, 2)
+    parsed = ConnectionInSchema.parse_obj(
+        {"name": "test-bulk-rows", "dialect": "duck_db", "model": None, "extra": None}
+    )
+    response = test_client.post("/connection", data=parsed.json())  # type: ignore
+    assert response.status_code == 200
+
+    def raw(text: str):
+        response = test_client.post(
+            "/raw_query", json={"connection": "test-bulk-rows", "query": text}
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    raw("create table bulk_rows (a integer, b varchar)")
+    rows = [[idx, f"row-{idx}"] for idx in range(5)]
+    response = test_client.post(
+        "/bulk_insert",
+        json={
+            "connection": "test-bulk-rows",
+            "table": "bulk_rows",
+            "columns": ["a", "b"],
+            "rows": rows,
+        },
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["inserted"] == 5
+
+    results = raw("select a, b from bulk_rows order by a")["results"]
+    assert [[row["a"], row["b"]] for row in results] == rows
+
+
 # def test_async_functions(test_client: TestClient):
 #     response = test_client.post("/long_sleep", json={"sleep": 1})
 #     assert response.status_code == 200
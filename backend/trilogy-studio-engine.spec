@@ -30,10 +30,13 @@ tmp_ret = collect_all('uvicorn')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
 tmp_ret = collect_all('duckdb')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
-tmp_ret = collect_all('duckdb-engine')
+tmp_ret = collect_all('duckdb_engine')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
-tmp_ret = collect_all('sqlalchemy-bigquery')
+tmp_ret = collect_all('sqlalchemy_bigquery')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
+# main.py never imports the sqlalchemy dialects directly; they are loaded
+# by url scheme at runtime, so name them for the bundle explicitly
+hiddenimports += ['duckdb_engine', 'sqlalchemy_bigquery']
 
 
 block_cipher = None